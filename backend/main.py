@@ -1,11 +1,24 @@
 import base64
+import hashlib
+import hmac
+import json
 import os 
+import queue
+import re
+import shutil
+import struct
+import threading
+import time
 import uuid 
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Callable, Iterator, Tuple
+from dataclasses import dataclass, field, asdict, replace
 
 import boto3
 import modal 
+import numpy as np
 import requests 
 from pydantic import BaseModel
 from fastapi import HTTPException, Depends, Request
@@ -14,34 +27,6 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from prompts import LYRICS_GENERATOR_PROMPT, PROMPT_GENERATOR_PROMPT
 
 
-# ===========================
-# SECURITY SECTION
-# ===========================
-
-class BearerTokenAuth:
-    """Bearer token authentication handler"""
-
-    def __init__(self):
-        self.security = HTTPBearer()
-        self.valid_token = os.environ.get("API_BEARER_TOKEN")
-
-        if not self.valid_token:
-            raise ValueError("API_BEARER_TOKEN environment variable must be set")
-    
-    def __call__(self, credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
-        """Validate bearer token"""
-        if credentials.credentials != self.valid_token:
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        return credentials.credentials
-    
-# Initialize auth handler
-bearer_auth = BearerTokenAuth()
-
 # ===========================
 # CONFIGURATION SECTION
 # ===========================
@@ -53,9 +38,12 @@ class ModelConfig:
     # Music Generation
     music_model_checkpoint_dir: str = "/models"
     music_model_dtype: str = "bfloat16"
-    music_model_torch_compile: bool = False
-    music_model_cpu_offload: bool = False
-    music_model_overlapped_decode: bool = False
+    music_engine_profile_env: str = "MUSIC_ENGINE_PROFILE"
+    music_engine_profile: str = "auto"
+    # Compiled profiles are traced at these durations at startup, not on the first requests
+    music_warmup: bool = True
+    music_warmup_durations: Tuple[float, ...] = (30.0, 60.0, 180.0)
+    music_warmup_infer_step: int = 3
 
     # Large Language Model
     llm_model_id: str = "Qwen/Qwen2-7B-Instruct"
@@ -65,6 +53,64 @@ class ModelConfig:
     image_model_id: str = "stabilityai/sdxl-turbo"
     image_inference_steps: int = 2
     image_guidance_scale: float = 0.0
+    image_width: int = 512
+    image_height: int = 512
+    image_batch_size: int = 4
+    image_max_covers_per_request: int = 16
+    image_channels_last: bool = True
+    image_attention_slicing: bool = False
+    image_vae_tiling: bool = False
+    image_torch_compile: bool = False
+    image_compile_mode: str = "max-autotune"
+    image_warmup: bool = True
+    image_warmup_prompt: str = "abstract album cover art"
+
+@dataclass
+class MusicEngineProfile:
+    """ACE-Step pipeline settings for one deployment tradeoff"""
+    name: str
+    torch_compile: bool
+    cpu_offload: bool
+    overlapped_decode: bool
+    min_gpu_memory_gb: float
+    auto_selectable: bool = True
+
+
+# Ordered by preference; "auto" picks the first auto-selectable profile whose
+# memory floor the GPU meets. Compiled profiles are opt-in because every new
+# audio length recompiles until the shape is marked dynamic.
+ENGINE_PROFILES: Dict[str, MusicEngineProfile] = {
+    "low-latency": MusicEngineProfile(
+        name="low-latency",
+        torch_compile=True,
+        cpu_offload=False,
+        overlapped_decode=False,
+        min_gpu_memory_gb=40.0,
+        auto_selectable=False
+    ),
+    "high-throughput": MusicEngineProfile(
+        name="high-throughput",
+        torch_compile=True,
+        cpu_offload=False,
+        overlapped_decode=True,
+        min_gpu_memory_gb=20.0,
+        auto_selectable=False
+    ),
+    "balanced": MusicEngineProfile(
+        name="balanced",
+        torch_compile=False,
+        cpu_offload=False,
+        overlapped_decode=False,
+        min_gpu_memory_gb=20.0
+    ),
+    "low-vram": MusicEngineProfile(
+        name="low-vram",
+        torch_compile=False,
+        cpu_offload=True,
+        overlapped_decode=True,
+        min_gpu_memory_gb=0.0
+    ),
+}
 
 @dataclass
 class InfrastructureConfig:
@@ -73,12 +119,28 @@ class InfrastructureConfig:
     app_name: str = "music-generator"
     gpu_type: str = "L40S"
     scaledown_window: int = 15
+    # Inputs per container; they share one GPU lock, so higher values trade
+    # tail latency for deduplication and Modal scales out only when saturated
+    max_concurrent_inputs: int = 2
     hf_cache_dir: str = "/.cache/huggingface"
     temp_output_dir: str = "/tmp/outputs"
+    temp_ram_disk_dir: str = "/dev/shm/outputs"
+    temp_use_ram_disk: bool = True
+    temp_max_bytes: int = 2 * 1024 ** 3
+    temp_min_free_bytes: int = 512 * 1024 ** 2
+    temp_wait_seconds: float = 60.0
+
+    latent_cache_dir: str = "/latent-cache"
+    latent_cache_max_bytes: int = 20 * 1024 ** 3
+    latent_cache_reload_seconds: float = 10.0
+    benchmark_timeout: int = 3600
+    benchmark_dir: str = "/benchmarks"
 
     # Volume names
     model_volume_name: str = "ace-step-models"
     hf_cache_volume_name: str = "qwen-hf-cache"
+    latent_cache_volume_name: str = "song-latent-cache"
+    benchmark_volume_name: str = "engine-benchmarks"
     secret_name: str = "music-gen-secret"
 
 @dataclass
@@ -99,6 +161,36 @@ class AudioConfig:
     default_guidance_scale: float = 15.0
     default_infer_step: int = 60
     default_instrumental: bool = False
+    max_duration: float = 240.0
+    default_retake_variance: float = 0.2
+    default_repaint_variance: float = 0.5
+
+
+@dataclass
+class AnalysisConfig:
+    """Parameters for the audio analysis sidecar"""
+    peak_samples_per_peak: Tuple[int, ...] = (512, 2048, 8192)
+    sidecar_extension: str = "analysis.json"
+    bpm_sample_rate: int = 12000
+    bpm_frame_size: int = 1024
+    bpm_hop_size: int = 256
+    bpm_min: float = 60.0
+    bpm_max: float = 200.0
+    bpm_prior: float = 120.0
+
+
+@dataclass
+class AuthConfig:
+    """Configuration for API keys and per-key limits"""
+    api_keys_env: str = "API_KEYS"
+    legacy_token_env: str = "API_BEARER_TOKEN"
+    default_requests_per_minute: int = 30
+    default_gpu_seconds_per_day: float = 4 * 3600.0
+    # None means unlimited; the legacy API_BEARER_TOKEN key is the admin key
+    legacy_requests_per_minute: Optional[int] = None
+    legacy_gpu_seconds_per_day: Optional[float] = None
+    usage_dict_name: str = "api-key-usage"
+    lookup_cache_size: int = 256
 
 
 # Initialize configurations
@@ -106,6 +198,217 @@ MODEL_CONFIG = ModelConfig()
 INFRA_CONFIG = InfrastructureConfig()
 STORAGE_CONFIG = StorageConfig()
 AUDIO_CONFIG = AudioConfig()
+AUTH_CONFIG = AuthConfig()
+ANALYSIS_CONFIG = AnalysisConfig()
+
+# ===========================
+# SECURITY SECTION
+# ===========================
+
+# Shared bearer scheme; every endpoint reuses this one dependency
+http_bearer = HTTPBearer()
+
+# Key of the request being served, used to attribute GPU time
+CURRENT_API_KEY: ContextVar[Optional["APIKey"]] = ContextVar("current_api_key", default=None)
+
+
+def hash_token(token: str) -> str:
+    """Return the hex SHA-256 digest stored in place of an API key"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class APIKey:
+    """An API key entry; only the digest of the secret is kept. A limit of None means unlimited"""
+    key_id: str
+    token_hash: str
+    requests_per_minute: Optional[int] = AUTH_CONFIG.default_requests_per_minute
+    gpu_seconds_per_day: Optional[float] = AUTH_CONFIG.default_gpu_seconds_per_day
+    admin: bool = False
+
+
+def _empty_usage() -> Dict[str, Any]:
+    """Counters for one key and UTC day, as stored in the shared usage dict"""
+    return {"requests": 0, "rejected": 0, "gpu_seconds": 0.0, "minute": 0, "minute_requests": 0}
+
+
+class APIKeyAuth:
+    """Multi-key bearer authentication with per-key rate limits and GPU quotas
+    
+    Usage is kept in a modal.Dict shared by every container, one record per key
+    and UTC day, so limits survive cold starts and hold across scale-out. Updates
+    are read-modify-write, so concurrent containers can occasionally lose an
+    increment; limits are approximate by that margin. Only the token lookup
+    cache is local to the container.
+    """
+
+    def __init__(self, usage_store: Optional[Any] = None):
+        self._lock = threading.Lock()
+        self._keys: Optional[List[APIKey]] = None
+        self._cache_lock = threading.Lock()
+        self._cache: "OrderedDict[str, APIKey]" = OrderedDict()
+        self._usage_store = usage_store
+        # One lock per key so a key's remote read-modify-write never blocks other keys
+        self._usage_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def usage_store(self) -> Any:
+        """Shared usage dict, looked up on first use"""
+        if self._usage_store is None:
+            self._usage_store = modal.Dict.from_name(AUTH_CONFIG.usage_dict_name, create_if_missing=True)
+        return self._usage_store
+
+    def _load_keys(self) -> List[APIKey]:
+        """Read keys from API_KEYS (JSON list) and the legacy API_BEARER_TOKEN"""
+        keys = []
+
+        raw_keys = os.environ.get(AUTH_CONFIG.api_keys_env)
+        if raw_keys:
+            for entry in json.loads(raw_keys):
+                admin = entry.get("admin", False)
+                keys.append(APIKey(
+                    key_id=entry["id"],
+                    token_hash=entry["sha256"].lower(),
+                    # Admin keys are unlimited unless limits are given explicitly
+                    requests_per_minute=entry.get(
+                        "requests_per_minute", None if admin else AUTH_CONFIG.default_requests_per_minute
+                    ),
+                    gpu_seconds_per_day=entry.get(
+                        "gpu_seconds_per_day", None if admin else AUTH_CONFIG.default_gpu_seconds_per_day
+                    ),
+                    admin=admin
+                ))
+
+        legacy_token = os.environ.get(AUTH_CONFIG.legacy_token_env)
+        if legacy_token:
+            keys.append(APIKey(
+                key_id="default",
+                token_hash=hash_token(legacy_token),
+                requests_per_minute=AUTH_CONFIG.legacy_requests_per_minute,
+                gpu_seconds_per_day=AUTH_CONFIG.legacy_gpu_seconds_per_day,
+                admin=True
+            ))
+
+        if not keys:
+            raise ValueError(
+                f"{AUTH_CONFIG.api_keys_env} or {AUTH_CONFIG.legacy_token_env} environment variable must be set"
+            )
+        return keys
+
+    def load(self) -> List[APIKey]:
+        """Load keys from the environment, raising if none are configured"""
+        if self._keys is None:
+            keys = self._load_keys()
+            with self._lock:
+                if self._keys is None:
+                    self._keys = keys
+        return self._keys
+
+    @property
+    def keys(self) -> List[APIKey]:
+        """Configured keys, loaded from the environment on first use"""
+        return self.load()
+
+    def lookup(self, token: str) -> Optional[APIKey]:
+        """Find the key for a token, comparing digests in constant time"""
+        token_hash = hash_token(token)
+
+        with self._cache_lock:
+            cached = self._cache.get(token_hash)
+            if cached is not None:
+                self._cache.move_to_end(token_hash)
+                return cached
+
+        match = None
+        for key in self.keys:
+            # Check every key so timing does not depend on which one matched
+            if hmac.compare_digest(token_hash, key.token_hash):
+                match = key
+
+        if match is not None:
+            with self._cache_lock:
+                self._cache[token_hash] = match
+                if len(self._cache) > AUTH_CONFIG.lookup_cache_size:
+                    self._cache.popitem(last=False)
+        return match
+
+    def _usage_lock(self, key_id: str) -> threading.Lock:
+        """Lock serializing one key's usage updates within this container"""
+        with self._lock:
+            return self._usage_locks.setdefault(key_id, threading.Lock())
+
+    @staticmethod
+    def _usage_key(key_id: str, now: float) -> str:
+        """Shared dict key for a key's usage on the UTC day containing now"""
+        return f"{key_id}:{time.strftime('%Y-%m-%d', time.gmtime(now))}"
+
+    def _check_limits(self, key: APIKey) -> None:
+        """Count the request, raising 429 if the key is over its rate limit or GPU quota"""
+        now = time.time()
+        minute = int(now // 60)
+        usage_key = self._usage_key(key.key_id, now)
+
+        with self._usage_lock(key.key_id):
+            usage = self.usage_store.get(usage_key) or _empty_usage()
+            if usage["minute"] != minute:
+                usage["minute"] = minute
+                usage["minute_requests"] = 0
+
+            if key.requests_per_minute is not None and usage["minute_requests"] >= key.requests_per_minute:
+                usage["rejected"] += 1
+                detail = "Rate limit exceeded"
+            elif key.gpu_seconds_per_day is not None and usage["gpu_seconds"] >= key.gpu_seconds_per_day:
+                usage["rejected"] += 1
+                detail = "Daily GPU quota exceeded"
+            else:
+                usage["requests"] += 1
+                usage["minute_requests"] += 1
+                detail = None
+
+            self.usage_store[usage_key] = usage
+
+        if detail is not None:
+            raise HTTPException(status_code=429, detail=detail)
+
+    def record_gpu_seconds(self, key_id: str, seconds: float) -> None:
+        """Charge GPU time to a key"""
+        usage_key = self._usage_key(key_id, time.time())
+        with self._usage_lock(key_id):
+            usage = self.usage_store.get(usage_key) or _empty_usage()
+            usage["gpu_seconds"] += seconds
+            self.usage_store[usage_key] = usage
+
+    def metrics(self, key_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Today's (UTC) counters across all containers, for one key or all of them"""
+        now = time.time()
+        snapshot = {}
+        for key in self.keys:
+            if key_id is not None and key.key_id != key_id:
+                continue
+            usage = self.usage_store.get(self._usage_key(key.key_id, now)) or _empty_usage()
+            snapshot[key.key_id] = {
+                "requests": usage["requests"],
+                "rejected": usage["rejected"],
+                "gpu_seconds": round(usage["gpu_seconds"], 3),
+            }
+        return snapshot
+
+    def __call__(self, credentials: HTTPAuthorizationCredentials = Depends(http_bearer)) -> APIKey:
+        """Validate bearer token and apply the key's limits"""
+        key = self.lookup(credentials.credentials)
+        if key is None:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid authentication credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        self._check_limits(key)
+        return key
+    
+# Initialize auth handler; keys are read from the environment on first request
+api_auth = APIKeyAuth()
+
 
 
 # ===========================
@@ -138,11 +441,48 @@ class GenerateWithDescribedLyricsRequest(AudioGenerationBase):
     described_lyrics: str
 
 
+class SongEditBase(BaseModel):
+    """Base model for editing a previously generated song"""
+    song_r2_key: str
+    seed: int = AUDIO_CONFIG.default_seed
+
+
+class RetakeSongRequest(SongEditBase):
+    """Request model for a new take of a whole song"""
+    variance: float = AUDIO_CONFIG.default_retake_variance
+
+
+class RepaintSongRequest(SongEditBase):
+    """Request model for regenerating a region of a song"""
+    start: float
+    end: float
+    variance: float = AUDIO_CONFIG.default_repaint_variance
+    prompt: Optional[str] = None
+    lyrics: Optional[str] = None
+
+
+class ExtendSongRequest(SongEditBase):
+    """Request model for extending a song at either end"""
+    left_seconds: float = 0.0
+    right_seconds: float = 30.0
+
+
+class GenerateCoversRequest(BaseModel):
+    """Request model for generating cover art for several songs"""
+    prompts: List[str]
+
+
 class GenerateMusicResponseR2(BaseModel):
     """Response model for music generation with R2 storage"""
     r2_key: str
     cover_image_r2_key: str
     categories: List[str]
+    analysis_r2_key: Optional[str] = None
+
+
+class GenerateCoversResponse(BaseModel):
+    """Response model for batched cover art generation"""
+    cover_image_r2_keys: List[str]
 
 
 class GenerateMusicResponse(BaseModel):
@@ -156,6 +496,11 @@ class AuthStatusResponse(BaseModel):
     message: str
 
 
+class UsageMetricsResponse(BaseModel):
+    """Response model for per-key usage counters"""
+    keys: Dict[str, Dict[str, Any]]
+
+
 # ===========================
 # MODAL SETUP SECTION
 # ===========================
@@ -178,6 +523,8 @@ image = (
 # Volume setup
 model_volume = modal.Volume.from_name(INFRA_CONFIG.model_volume_name, create_if_missing=True)
 hf_volume = modal.Volume.from_name(INFRA_CONFIG.hf_cache_volume_name, create_if_missing=True)
+latent_volume = modal.Volume.from_name(INFRA_CONFIG.latent_cache_volume_name, create_if_missing=True)
+benchmark_volume = modal.Volume.from_name(INFRA_CONFIG.benchmark_volume_name, create_if_missing=True)
 
 # Secrets setup - now includes the API bearer token
 music_gen_secrets = modal.Secret.from_name(INFRA_CONFIG.secret_name)
@@ -209,31 +556,832 @@ class StorageManager:
         self.client.upload_file(local_path, self.bucket_name, r2_key)
         return r2_key
     
+    def upload_bytes(self, data: bytes, r2_key: str, content_type: str) -> str:
+        """Upload in-memory data to Cloudflare R2 and return the key"""
+        self.client.put_object(
+            Bucket=self.bucket_name,
+            Key=r2_key,
+            Body=data,
+            ContentType=content_type
+        )
+        return r2_key
+    
+    def sidecar_key(self, r2_key: str, extension: str) -> str:
+        """Derive the key of a file stored next to another one"""
+        return f"{os.path.splitext(r2_key)[0]}.{extension.lstrip('.')}"
+    
     def generate_unique_key(self, extension: str) -> str:
         """Generate a unique key for R2 storage"""
         return f"{uuid.uuid4()}.{extension.lstrip('.')}"
 
 
 class FileManager:
-    """Handles temporary file operations"""
+    """Handles temporary file operations within a size quota
     
-    def __init__(self, base_dir: str = INFRA_CONFIG.temp_output_dir):
-        self.base_dir = base_dir
+    Every file lives in its own directory for the duration of a temp_file
+    block. Nothing can be evicted while in use, so the quota is enforced by
+    making new temp files wait until running requests release theirs.
+    """
+    
+    def __init__(
+        self,
+        base_dir: Optional[str] = None,
+        use_ram_disk: bool = INFRA_CONFIG.temp_use_ram_disk,
+        max_bytes: int = INFRA_CONFIG.temp_max_bytes,
+        min_free_bytes: int = INFRA_CONFIG.temp_min_free_bytes,
+        wait_seconds: float = INFRA_CONFIG.temp_wait_seconds,
+        ram_disk_dir: str = INFRA_CONFIG.temp_ram_disk_dir,
+        fallback_dir: str = INFRA_CONFIG.temp_output_dir
+    ):
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.wait_seconds = wait_seconds
+        self.base_dir = base_dir or self._select_base_dir(use_ram_disk, ram_disk_dir, fallback_dir)
         os.makedirs(self.base_dir, exist_ok=True)
+        
+        # Directories of files in use, with the size of what has been written to them
+        self._lock = threading.Lock()
+        self._space = threading.Condition(self._lock)
+        self._entries: Dict[str, int] = {}
+        
+        self.sweep_orphans()
     
-    def get_temp_path(self, filename: str = None) -> str:
-        """Get temporary file path"""
-        if filename is None:
-            filename = f"{uuid.uuid4()}.tmp"
-        return os.path.join(self.base_dir, filename)
+    def _select_base_dir(self, use_ram_disk: bool, ram_disk_dir: str, fallback_dir: str) -> str:
+        """Pick the RAM disk when it exists and can hold the quota, else local disk"""
+        if use_ram_disk:
+            ram_root = os.path.dirname(ram_disk_dir)
+            try:
+                if shutil.disk_usage(ram_root).free >= self.max_bytes:
+                    return ram_disk_dir
+            except OSError:
+                pass
+            print(f"RAM disk unavailable at {ram_root}, using {fallback_dir}")
+        return fallback_dir
+    
+    @property
+    def total_bytes(self) -> int:
+        """Total size of files in use"""
+        with self._lock:
+            return sum(self._entries.values())
+    
+    @contextmanager
+    def temp_file(self, extension: str = "tmp") -> Iterator[str]:
+        """Yield a file path in its own temporary directory, removed with everything in it on exit
+        
+        Waits for in-use files to be released while storage is over quota, and
+        rejects the request with 503 if that takes longer than wait_seconds.
+        """
+        with self._space:
+            deadline = time.monotonic() + self.wait_seconds
+            while self._is_under_pressure():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="Temporary storage is full, please retry later"
+                    )
+                self._space.wait(remaining)
+            
+            # A directory per call also catches files the models write next to save_path
+            dirpath = os.path.join(self.base_dir, uuid.uuid4().hex)
+            os.makedirs(dirpath)
+            self._entries[dirpath] = 0
+        
+        try:
+            yield os.path.join(dirpath, f"{uuid.uuid4()}.{extension.lstrip('.')}")
+        finally:
+            self.cleanup_file(dirpath)
+    
+    def track(self, filepath: str) -> None:
+        """Record the size of a file written inside a temp_file block"""
+        entry = os.path.dirname(filepath)
+        size = _path_size(entry)
+        with self._lock:
+            if entry in self._entries:
+                self._entries[entry] = size
     
     def cleanup_file(self, filepath: str) -> None:
-        """Safely remove temporary file"""
+        """Safely remove a temporary file or directory and wake waiting requests"""
         try:
-            if os.path.exists(filepath):
+            if os.path.isdir(filepath):
+                shutil.rmtree(filepath, ignore_errors=True)
+            elif os.path.exists(filepath):
                 os.remove(filepath)
         except OSError:
             pass  # File might already be deleted
+        
+        with self._space:
+            self._entries.pop(filepath, None)
+            self._space.notify_all()
+    
+    def sweep_orphans(self) -> int:
+        """Remove files in the temp directory that are not in use, e.g. left by a crash"""
+        with self._lock:
+            in_use = set(self._entries)
+        removed = 0
+        for entry in os.scandir(self.base_dir):
+            if entry.path not in in_use:
+                self.cleanup_file(entry.path)
+                removed += 1
+        if removed:
+            print(f"Removed {removed} orphaned temp files from {self.base_dir}")
+        return removed
+    
+    def _is_under_pressure(self) -> bool:
+        """Check the quota and the free space left on the temp filesystem; caller holds the lock"""
+        if sum(self._entries.values()) >= self.max_bytes:
+            return True
+        try:
+            return shutil.disk_usage(self.base_dir).free < self.min_free_bytes
+        except OSError:
+            return False
+
+
+def _path_size(path: str) -> int:
+    """Size of a file, or of all files directly inside a directory"""
+    try:
+        if os.path.isdir(path):
+            return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+@dataclass
+class _FlightCall:
+    """State for a single in-flight execution shared by its waiters"""
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Any = None
+    error: Optional[BaseException] = None
+    waiters: int = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _FlightCall] = {}
+
+    @staticmethod
+    def make_key(namespace: str, payload: Any) -> str:
+        """Build a stable key from a namespace and a JSON-serializable payload"""
+        normalized = _normalize_payload(payload)
+        encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn once per key; concurrent callers wait for and share the result"""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _FlightCall()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        """Number of keys currently executing"""
+        with self._lock:
+            return len(self._calls)
+
+
+def _normalize_payload(payload: Any) -> Any:
+    """Normalize a request payload so trivially different copies hash the same"""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump()
+    if isinstance(payload, dict):
+        return {k: _normalize_payload(v) for k, v in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [_normalize_payload(v) for v in payload]
+    if isinstance(payload, str):
+        return payload.strip()
+    if isinstance(payload, float) and payload.is_integer():
+        return int(payload)
+    return payload
+
+
+# ===========================
+# AUDIO ANALYSIS SECTION
+# ===========================
+
+class AudioAnalyzer:
+    """Computes waveform peaks, duration, loudness and tempo for a generated WAV"""
+    
+    def __init__(self, config: AnalysisConfig = ANALYSIS_CONFIG):
+        self.config = config
+    
+    def analyze_file(self, path: str) -> Dict[str, Any]:
+        """Read a WAV file and return its analysis"""
+        samples, sample_rate = self.read_wav(path)
+        return self.analyze(samples, sample_rate)
+    
+    def analyze(self, samples: np.ndarray, sample_rate: int) -> Dict[str, Any]:
+        """Analyze float samples shaped (frames, channels) in [-1, 1]"""
+        loudness = self.integrated_loudness(samples, sample_rate)
+        return {
+            "version": 1,
+            "sample_rate": sample_rate,
+            "channels": samples.shape[1],
+            "duration": round(samples.shape[0] / sample_rate, 3),
+            "integrated_loudness_lufs": None if loudness is None else round(loudness, 2),
+            "bpm": self.estimate_bpm(samples, sample_rate),
+            "peaks": self.compute_peaks(samples),
+        }
+    
+    def encode_sidecar(self, analysis: Dict[str, Any]) -> bytes:
+        """Serialize an analysis to compact JSON"""
+        return json.dumps(analysis, separators=(",", ":")).encode("utf-8")
+    
+    @staticmethod
+    def read_wav(path: str) -> Tuple[np.ndarray, int]:
+        """Decode PCM (8/16/24/32-bit) or float WAV into float32 (frames, channels)"""
+        with open(path, "rb") as f:
+            data = f.read()
+        
+        if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file")
+        
+        fmt = None
+        data_offset = data_size = None
+        pos = 12
+        while pos + 8 <= len(data):
+            chunk_id = data[pos:pos + 4]
+            chunk_size = int.from_bytes(data[pos + 4:pos + 8], "little")
+            body = pos + 8
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", data[body:body + 16])
+                if fmt[0] == 0xFFFE:
+                    # WAVE_FORMAT_EXTENSIBLE keeps the real format in the sub-format GUID
+                    fmt = (int.from_bytes(data[body + 24:body + 26], "little"),) + fmt[1:]
+            elif chunk_id == b"data":
+                # Streaming writers may leave the size unset; read to end of file
+                data_offset = body
+                data_size = min(chunk_size, len(data) - body)
+                break
+            pos = body + chunk_size + (chunk_size & 1)
+        
+        if fmt is None or data_offset is None:
+            raise ValueError(f"{path} is missing a fmt or data chunk")
+        
+        format_tag, channels, sample_rate, _, _, bits = fmt
+        width = bits // 8
+        count = data_size // width
+        count -= count % channels
+        
+        if format_tag == 3 and bits in (32, 64):
+            samples = np.frombuffer(data, dtype=f"<f{width}", count=count, offset=data_offset)
+        elif format_tag == 1 and bits == 8:
+            raw = np.frombuffer(data, dtype=np.uint8, count=count, offset=data_offset)
+            samples = (raw.astype(np.float32) - 128) / 128
+        elif format_tag == 1 and bits in (16, 32):
+            raw = np.frombuffer(data, dtype=f"<i{width}", count=count, offset=data_offset)
+            samples = raw.astype(np.float32) / 2 ** (bits - 1)
+        elif format_tag == 1 and bits == 24:
+            raw = np.frombuffer(data, dtype=np.uint8, count=count * 3, offset=data_offset).reshape(-1, 3)
+            joined = raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16)
+            samples = ((joined << 8) >> 8).astype(np.float32) / 2 ** 23
+        else:
+            raise ValueError(f"Unsupported WAV format {format_tag} with {bits} bits")
+        
+        return samples.astype(np.float32, copy=False).reshape(-1, channels), sample_rate
+    
+    def compute_peaks(self, samples: np.ndarray) -> List[Dict[str, Any]]:
+        """Min/max peaks at each configured resolution, as base64 interleaved int8 pairs"""
+        frame_min = samples.min(axis=1)
+        frame_max = samples.max(axis=1)
+        
+        levels = []
+        prev_mins, prev_maxs, prev_step = frame_min, frame_max, 1
+        for samples_per_peak in sorted(self.config.peak_samples_per_peak):
+            # Build each level from the finer one when it divides evenly
+            if samples_per_peak % prev_step == 0:
+                factor = samples_per_peak // prev_step
+                mins, maxs = prev_mins, prev_maxs
+            else:
+                factor = samples_per_peak
+                mins, maxs = frame_min, frame_max
+            
+            pad = -len(mins) % factor
+            mins = np.pad(mins, (0, pad), mode="edge").reshape(-1, factor).min(axis=1)
+            maxs = np.pad(maxs, (0, pad), mode="edge").reshape(-1, factor).max(axis=1)
+            
+            interleaved = np.empty(len(mins) * 2, dtype=np.int8)
+            interleaved[0::2] = np.clip(np.round(mins * 127), -128, 127)
+            interleaved[1::2] = np.clip(np.round(maxs * 127), -128, 127)
+            levels.append({
+                "samples_per_peak": samples_per_peak,
+                "length": len(mins),
+                "bits": 8,
+                "data": base64.b64encode(interleaved.tobytes()).decode("ascii"),
+            })
+            prev_mins, prev_maxs, prev_step = mins, maxs, samples_per_peak
+        
+        return levels
+    
+    @staticmethod
+    def _k_weighting_response(n_fft: int, sample_rate: int) -> np.ndarray:
+        """Magnitude response of the BS.1770 K-weighting filter at rfft bin frequencies"""
+        # High shelf (head effects) then high pass (RLB), matching the 48 kHz reference
+        # coefficients and re-derived for other sample rates
+        w = 2 * np.pi * np.fft.rfftfreq(n_fft, d=1.0 / sample_rate) / sample_rate
+        z1 = np.exp(-1j * w)
+        z2 = z1 * z1
+        
+        gain, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+        k = np.tan(np.pi * fc / sample_rate)
+        vh = 10 ** (gain / 20)
+        vb = vh ** 0.4996667741545416
+        shelf = (
+            (vh + vb * k / q + k * k) + 2 * (k * k - vh) * z1 + (vh - vb * k / q + k * k) * z2
+        ) / (
+            (1 + k / q + k * k) + 2 * (k * k - 1) * z1 + (1 - k / q + k * k) * z2
+        )
+        
+        q, fc = 0.5003270373238773, 38.13547087602444
+        k = np.tan(np.pi * fc / sample_rate)
+        a0 = 1 + k / q + k * k
+        high_pass = (1 - 2 * z1 + z2) / (1 + (2 * (k * k - 1) * z1 + (1 - k / q + k * k) * z2) / a0)
+        
+        return np.abs(shelf * high_pass)
+    
+    def integrated_loudness(self, samples: np.ndarray, sample_rate: int) -> Optional[float]:
+        """Gated integrated loudness in LUFS per ITU-R BS.1770, or None if too short or silent"""
+        frames = samples.shape[0]
+        block = int(round(0.4 * sample_rate))
+        step = int(round(0.1 * sample_rate))
+        if frames < block:
+            return None
+        
+        # Filter in the frequency domain; only the energy per block matters
+        n_fft = _next_fast_len(frames + block)
+        spectrum = np.fft.rfft(samples, n=n_fft, axis=0)
+        spectrum *= self._k_weighting_response(n_fft, sample_rate)[:, None]
+        weighted = np.fft.irfft(spectrum, n=n_fft, axis=0)[:frames]
+        
+        # Mean square of every 400 ms block with 75% overlap, summed over channels
+        energy = np.concatenate([np.zeros((1, samples.shape[1])), np.cumsum(weighted ** 2, axis=0)])
+        starts = np.arange(0, frames - block + 1, step)
+        block_power = ((energy[starts + block] - energy[starts]) / block).sum(axis=1)
+        
+        with np.errstate(divide="ignore"):
+            block_loudness = -0.691 + 10 * np.log10(block_power)
+        
+        gated = block_power[block_loudness > -70.0]
+        if gated.size == 0:
+            return None
+        relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+        gated = block_power[(block_loudness > -70.0) & (block_loudness > relative_gate)]
+        return float(-0.691 + 10 * np.log10(gated.mean()))
+    
+    def estimate_bpm(self, samples: np.ndarray, sample_rate: int) -> Optional[float]:
+        """Estimate tempo from the autocorrelation of a spectral-flux onset envelope"""
+        # Mix down and decimate; onsets do not need the full bandwidth
+        factor = max(1, sample_rate // self.config.bpm_sample_rate)
+        mono = samples.mean(axis=1)
+        mono = mono[:len(mono) - len(mono) % factor].reshape(-1, factor).mean(axis=1)
+        rate = sample_rate / factor
+        
+        frame, hop = self.config.bpm_frame_size, self.config.bpm_hop_size
+        if len(mono) < frame + hop * 8:
+            return None
+        
+        windows = np.lib.stride_tricks.sliding_window_view(mono, frame)[::hop] * np.hanning(frame)
+        magnitude = np.log1p(100 * np.abs(np.fft.rfft(windows, axis=1)))
+        onset = np.maximum(np.diff(magnitude, axis=0), 0).sum(axis=1)
+        onset -= onset.mean()
+        if not onset.any():
+            return None
+        
+        n_fft = _next_fast_len(2 * len(onset))
+        autocorr = np.fft.irfft(np.abs(np.fft.rfft(onset, n=n_fft)) ** 2, n=n_fft)[:len(onset)]
+        
+        frame_rate = rate / hop
+        min_lag = max(1, int(np.floor(60 * frame_rate / self.config.bpm_max)))
+        max_lag = min(len(autocorr) - 2, int(np.ceil(60 * frame_rate / self.config.bpm_min)))
+        if max_lag <= min_lag:
+            return None
+        
+        # Log-normal prior around a typical tempo to avoid octave errors
+        lags = np.arange(min_lag, max_lag + 1)
+        prior = np.exp(-0.5 * (np.log2(60 * frame_rate / lags / self.config.bpm_prior)) ** 2)
+        best = lags[np.argmax(autocorr[lags] * prior)]
+        
+        # Parabolic interpolation around the peak for sub-frame lag
+        left, center, right = autocorr[best - 1], autocorr[best], autocorr[best + 1]
+        denominator = left - 2 * center + right
+        offset = 0.5 * (left - right) / denominator if denominator else 0.0
+        return round(float(60 * frame_rate / (best + offset)), 1)
+
+
+def _next_fast_len(n: int) -> int:
+    """Smallest 2^a * 3^b * 5^c >= n, which numpy's FFT handles quickly"""
+    best = 1 << (n - 1).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            candidate = power35
+            while candidate < n:
+                candidate *= 2
+            best = min(best, candidate)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+# ===========================
+# LATENT CACHE SECTION
+# ===========================
+
+@dataclass
+class CachedSong:
+    """Conditioning and metadata needed to edit a generated song"""
+    prompt: str
+    lyrics: str
+    audio_duration: float
+    infer_step: int
+    guidance_scale: float
+    seeds: List[int]
+    cover_image_r2_key: str = ""
+    categories: List[str] = field(default_factory=list)
+    owner_key_id: str = ""
+    last_used: float = field(default_factory=time.time)
+
+
+@dataclass
+class GeneratedAudio:
+    """A music model run after upload, with what is needed to cache it"""
+    r2_key: str
+    analysis_r2_key: Optional[str]
+    seeds: List[int]
+    audio_duration: float
+    latents: Any = None
+
+
+class LatentStore:
+    """Volume-backed LRU store of ACE-Step latents and conditioning per song
+    
+    Writes, last-used updates, eviction and volume commits run on a background
+    thread so they never add latency to or fail a request. An in-memory index of
+    entry sizes in LRU order avoids rescanning the volume on every write. Songs
+    other containers wrote are picked up when a miss reloads the volume, at most
+    once per reload_seconds; a failed reload counts as a miss.
+    """
+    
+    def __init__(
+        self,
+        base_dir: str = INFRA_CONFIG.latent_cache_dir,
+        max_bytes: int = INFRA_CONFIG.latent_cache_max_bytes,
+        volume: Optional[modal.Volume] = None,
+        reload_seconds: float = INFRA_CONFIG.latent_cache_reload_seconds
+    ):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.volume = volume
+        self.reload_seconds = reload_seconds
+        self._last_reload = float("-inf")
+        self._lock = threading.Lock()
+        os.makedirs(self.base_dir, exist_ok=True)
+        
+        # Entry directory -> size in bytes, least recently used first
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        # Songs queued for writing, served from memory until they are on the volume
+        self._pending: Dict[str, Tuple[Any, CachedSong]] = {}
+        self._dirty = False
+        self._scan()
+        
+        self._tasks: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run_worker, name="latent-store", daemon=True)
+        self._worker.start()
+    
+    def _entry_dir(self, song_r2_key: str) -> str:
+        """Directory for a song, named after its audio key without the extension"""
+        song_id = os.path.splitext(os.path.basename(song_r2_key))[0]
+        if not song_id or not all(c.isalnum() or c == "-" for c in song_id):
+            raise ValueError(f"Invalid song key '{song_r2_key}'")
+        return os.path.join(self.base_dir, song_id)
+    
+    def put(self, song_r2_key: str, latents: Any, song: CachedSong) -> None:
+        """Queue a song's latents and conditioning for storage"""
+        entry_dir = self._entry_dir(song_r2_key)
+        with self._lock:
+            self._pending[entry_dir] = (latents, song)
+        self._tasks.put(lambda: self._write(entry_dir))
+    
+    def get(self, song_r2_key: str) -> Optional[Tuple[Any, CachedSong]]:
+        """Load a song's latents and conditioning, or None if it is not cached"""
+        import torch
+        
+        entry_dir = self._entry_dir(song_r2_key)
+        with self._lock:
+            pending = self._pending.get(entry_dir)
+            if pending is not None:
+                return pending
+            
+            # Another container may have written the song since this one started
+            if entry_dir not in self._index:
+                self._reload()
+            if entry_dir not in self._index:
+                return None
+            
+            try:
+                with open(os.path.join(entry_dir, "meta.json")) as f:
+                    song = CachedSong(**json.load(f))
+                latents = torch.load(os.path.join(entry_dir, "latents.pt"), map_location="cpu")
+            except Exception as e:
+                print(f"Latent cache read failed for {song_r2_key}: {type(e).__name__}: {e}")
+                return None
+            
+            self._index.move_to_end(entry_dir)
+        
+        song.last_used = time.time()
+        self._tasks.put(lambda: self._touch(entry_dir, song))
+        return latents, song
+    
+    def close(self, timeout: float = 60.0) -> None:
+        """Finish queued writes and commit them"""
+        self._tasks.put(None)
+        self._worker.join(timeout)
+    
+    def _run_worker(self) -> None:
+        """Run queued writes, committing once the queue drains"""
+        while True:
+            task = self._tasks.get()
+            if task is not None:
+                try:
+                    task()
+                except Exception as e:
+                    print(f"Latent cache update failed: {type(e).__name__}: {e}")
+            
+            # Only this thread writes, so nothing changes the volume during the commit;
+            # gets skip reloads until it finishes because the store is still dirty
+            if self._tasks.empty() and self._dirty:
+                try:
+                    self._commit()
+                    with self._lock:
+                        self._dirty = False
+                except Exception as e:
+                    print(f"Latent cache commit failed: {type(e).__name__}: {e}")
+            
+            if task is None:
+                return
+    
+    def _write(self, entry_dir: str) -> None:
+        """Write a queued song to the volume and evict old songs if over quota"""
+        import torch
+        
+        with self._lock:
+            latents, song = self._pending[entry_dir]
+            try:
+                os.makedirs(entry_dir, exist_ok=True)
+                torch.save(latents, os.path.join(entry_dir, "latents.pt"))
+                self._write_meta(entry_dir, song)
+                self._index[entry_dir] = _path_size(entry_dir)
+                self._index.move_to_end(entry_dir)
+            finally:
+                del self._pending[entry_dir]
+                self._dirty = True
+            self._evict()
+    
+    def _touch(self, entry_dir: str, song: CachedSong) -> None:
+        """Persist a song's last use so the LRU order survives restarts"""
+        with self._lock:
+            if os.path.isdir(entry_dir):
+                self._write_meta(entry_dir, song)
+                self._dirty = True
+    
+    def _write_meta(self, entry_dir: str, song: CachedSong) -> None:
+        """Write a song's conditioning next to its latents"""
+        with open(os.path.join(entry_dir, "meta.json"), "w") as f:
+            json.dump(asdict(song), f)
+    
+    def _scan(self) -> None:
+        """Rebuild the index from the volume, ordering songs by meta.json mtime"""
+        entries = []
+        for entry in os.scandir(self.base_dir):
+            if not entry.is_dir():
+                continue
+            try:
+                last_used = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+            except OSError:
+                last_used = 0.0
+            entries.append((last_used, entry.path, _path_size(entry.path)))
+        
+        self._index = OrderedDict((path, size) for _, path, size in sorted(entries))
+    
+    def _evict(self) -> None:
+        """Remove least recently used songs until the store is under quota; caller holds the lock"""
+        total = sum(self._index.values())
+        while total > self.max_bytes and len(self._index) > 1:
+            path, size = self._index.popitem(last=False)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+    
+    def _reload(self) -> None:
+        """Pick up songs other containers wrote; caller holds the lock
+        
+        Skipped while this container has uncommitted writes, which a reload could
+        drop, and when the last reload was under reload_seconds ago so unknown
+        song keys cannot force a reload on every request.
+        """
+        if self.volume is None or self._dirty:
+            return
+        now = time.monotonic()
+        if now - self._last_reload < self.reload_seconds:
+            return
+        self._last_reload = now
+        
+        try:
+            self.volume.reload()
+            self._scan()
+        except Exception as e:
+            print(f"Latent cache reload failed: {type(e).__name__}: {e}")
+    
+    def _commit(self) -> None:
+        """Persist changes so other containers can see them"""
+        if self.volume is not None:
+            self.volume.commit()
+
+
+# ===========================
+# ENGINES SECTION
+# ===========================
+
+def detect_gpu_memory_gb() -> float:
+    """Total memory of the first CUDA device in GiB, or 0 without a GPU"""
+    import torch
+    
+    if not torch.cuda.is_available():
+        return 0.0
+    return torch.cuda.get_device_properties(0).total_memory / 1024 ** 3
+
+
+def select_engine_profile(
+    name: Optional[str] = None,
+    gpu_memory_gb: Optional[float] = None
+) -> MusicEngineProfile:
+    """Resolve a profile by name, env var or detected GPU memory
+    
+    A pinned profile is loaded even on a GPU below its memory floor, with a
+    warning, since short songs may still fit.
+    """
+    if name is None:
+        name = os.environ.get(MODEL_CONFIG.music_engine_profile_env, MODEL_CONFIG.music_engine_profile)
+    name = name.strip().lower()
+    
+    if name != "auto":
+        if name not in ENGINE_PROFILES:
+            raise ValueError(
+                f"Unknown music engine profile '{name}', expected one of: auto, {', '.join(ENGINE_PROFILES)}"
+            )
+    
+    if gpu_memory_gb is None:
+        gpu_memory_gb = detect_gpu_memory_gb()
+    
+    if name != "auto":
+        profile = ENGINE_PROFILES[name]
+        if gpu_memory_gb < profile.min_gpu_memory_gb:
+            print(f"Warning: music engine profile '{name}' needs {profile.min_gpu_memory_gb:g} GiB of GPU memory, "
+                  f"found {gpu_memory_gb:.1f} GiB; expect out-of-memory errors or use 'low-vram'")
+        return profile
+    
+    for profile in ENGINE_PROFILES.values():
+        if profile.auto_selectable and gpu_memory_gb >= profile.min_gpu_memory_gb:
+            return profile
+    return ENGINE_PROFILES["low-vram"]
+
+
+def build_music_pipeline(profile: MusicEngineProfile):
+    """Create the ACE-Step pipeline with a profile's settings"""
+    from acestep.pipeline_ace_step import ACEStepPipeline
+    
+    return ACEStepPipeline(
+        checkpoint_dir=MODEL_CONFIG.music_model_checkpoint_dir,
+        dtype=MODEL_CONFIG.music_model_dtype,
+        torch_compile=profile.torch_compile,
+        cpu_offload=profile.cpu_offload,
+        overlapped_decode=profile.overlapped_decode
+    )
+
+
+def warmup_music_pipeline(
+    music_model,
+    file_manager: "FileManager",
+    durations: Tuple[float, ...] = MODEL_CONFIG.music_warmup_durations,
+    infer_step: int = MODEL_CONFIG.music_warmup_infer_step
+) -> Dict[float, float]:
+    """Run a short generation at each duration so compilation happens before serving
+    
+    Returns the seconds each warmup run took, keyed by duration.
+    """
+    timings = {}
+    for duration in durations:
+        with file_manager.temp_file("wav") as audio_path:
+            start = time.perf_counter()
+            music_model(
+                prompt="electronic rap",
+                lyrics="[instrumental]",
+                audio_duration=duration,
+                infer_step=infer_step,
+                guidance_scale=AUDIO_CONFIG.default_guidance_scale,
+                save_path=audio_path,
+                manual_seeds="42"
+            )
+            timings[duration] = time.perf_counter() - start
+    return timings
+
+
+class ImageEngine:
+    """Loads, optimizes and pre-warms the cover art pipeline"""
+    
+    def __init__(self, config: ModelConfig = MODEL_CONFIG, device: str = "cuda"):
+        self.config = config
+        self.device = device
+        self.pipe = None
+    
+    def load(self, cache_dir: Optional[str] = INFRA_CONFIG.hf_cache_dir) -> None:
+        """Load the pipeline and apply the configured kernel and memory options"""
+        from diffusers import AutoPipelineForText2Image
+        import torch
+        
+        # fp16 weights only pay off on GPU; the CPU path is for tiny test models
+        if self.device == "cuda":
+            dtype_kwargs = {"torch_dtype": torch.float16, "variant": "fp16"}
+        else:
+            dtype_kwargs = {"torch_dtype": torch.float32}
+        
+        self.pipe = AutoPipelineForText2Image.from_pretrained(
+            self.config.image_model_id,
+            cache_dir=cache_dir,
+            **dtype_kwargs
+        )
+        self.pipe.to(self.device)
+        self.pipe.set_progress_bar_config(disable=True)
+        
+        if self.config.image_channels_last:
+            self.pipe.unet.to(memory_format=torch.channels_last)
+            self.pipe.vae.to(memory_format=torch.channels_last)
+        if self.config.image_attention_slicing:
+            self.pipe.enable_attention_slicing()
+        if self.config.image_vae_tiling:
+            self.pipe.enable_vae_tiling()
+        if self.config.image_torch_compile:
+            # Shapes are fixed (resolution and batch sizes), so no dynamic recompiles
+            self.pipe.unet = torch.compile(
+                self.pipe.unet, mode=self.config.image_compile_mode, fullgraph=True
+            )
+    
+    def warmup(self) -> None:
+        """Run a dummy prompt at every batch shape so the first request skips lazy init"""
+        for batch_size in sorted({1, self.config.image_batch_size}):
+            self._run([self.config.image_warmup_prompt] * batch_size)
+    
+    def generate(self, prompts: List[str]) -> List[Any]:
+        """Generate one image per prompt, batching up to image_batch_size at a time"""
+        images = []
+        batch_size = self.config.image_batch_size
+        for start in range(0, len(prompts), batch_size):
+            chunk = prompts[start:start + batch_size]
+            
+            # Pad partial batches to a warmed-up shape and drop the extra images
+            padded = chunk
+            if 1 < len(chunk) < batch_size:
+                padded = chunk + [chunk[-1]] * (batch_size - len(chunk))
+            images.extend(self._run(padded)[:len(chunk)])
+        return images
+    
+    def _run(self, prompts: List[str]) -> List[Any]:
+        """Call the pipeline once at the configured cover resolution"""
+        import torch
+        
+        with torch.inference_mode():
+            return self.pipe(
+                prompt=prompts,
+                num_inference_steps=self.config.image_inference_steps,
+                guidance_scale=self.config.image_guidance_scale,
+                width=self.config.image_width,
+                height=self.config.image_height
+            ).images
 
 
 # ===========================
@@ -245,39 +1393,53 @@ class FileManager:
     gpu=INFRA_CONFIG.gpu_type,
     volumes={
         "/models": model_volume,
-        INFRA_CONFIG.hf_cache_dir: hf_volume
+        INFRA_CONFIG.hf_cache_dir: hf_volume,
+        INFRA_CONFIG.latent_cache_dir: latent_volume
     },
     secrets=[music_gen_secrets],
     scaledown_window=INFRA_CONFIG.scaledown_window
 )
+@modal.concurrent(max_inputs=INFRA_CONFIG.max_concurrent_inputs)
 class MusicGenServer:
     """Main music generation server class"""
     
     @modal.enter()
     def load_model(self):
         """Initialize all AI models and auth"""
+        # Initialize utility classes; the music warmup writes through the file manager
+        self.storage_manager = StorageManager()
+        self.file_manager = FileManager()
+        self.audio_analyzer = AudioAnalyzer()
+        self.latent_store = LatentStore(volume=latent_volume)
+        
         self._load_music_model()
         self._load_llm_model()
         self._load_image_model()
         
-        # Initialize utility classes
-        self.storage_manager = StorageManager()
-        self.file_manager = FileManager()
+        # Concurrent inputs share the GPU; identical ones share one execution
+        self.gpu_lock = threading.Lock()
+        self.single_flight = SingleFlight()
         
-        # Initialize authentication
-        self.bearer_auth = BearerTokenAuth()
+        # Fail fast on missing keys instead of on the first request
+        self.api_auth = api_auth
+        self.api_auth.load()
+    
+    @modal.exit()
+    def flush_caches(self):
+        """Write queued latent cache updates before the container stops"""
+        self.latent_store.close()
     
     def _load_music_model(self):
-        """Load the ACE Step music generation model"""
-        from acestep.pipeline_ace_step import ACEStepPipeline
-        
-        self.music_model = ACEStepPipeline(
-            checkpoint_dir=MODEL_CONFIG.music_model_checkpoint_dir,
-            dtype=MODEL_CONFIG.music_model_dtype,
-            torch_compile=MODEL_CONFIG.music_model_torch_compile,
-            cpu_offload=MODEL_CONFIG.music_model_cpu_offload,
-            overlapped_decode=MODEL_CONFIG.music_model_overlapped_decode
-        )
+        """Load the ACE Step music generation model with the selected engine profile"""
+        self.engine_profile = select_engine_profile()
+        print(f"Music engine profile: {self.engine_profile.name}")
+        
+        self.music_model = build_music_pipeline(self.engine_profile)
+        
+        # Compile for the common lengths now so the first requests don't pay for it
+        if self.engine_profile.torch_compile and MODEL_CONFIG.music_warmup:
+            timings = warmup_music_pipeline(self.music_model, self.file_manager)
+            print("Music warmup: " + ", ".join(f"{d:.0f}s in {t:.1f}s" for d, t in timings.items()))
     
     def _load_llm_model(self):
         """Load the language model for text generation"""
@@ -292,20 +1454,68 @@ class MusicGenServer:
         )
     
     def _load_image_model(self):
-        """Load the image generation model for thumbnails"""
-        from diffusers import AutoPipelineForText2Image
-        import torch
+        """Load and pre-warm the image generation model for thumbnails"""
+        self.image_engine = ImageEngine()
+        self.image_engine.load()
         
-        self.image_pipe = AutoPipelineForText2Image.from_pretrained(
-            MODEL_CONFIG.image_model_id,
-            torch_dtype=torch.float16,
-            variant="fp16",
-            cache_dir=INFRA_CONFIG.hf_cache_dir
+        if MODEL_CONFIG.image_warmup:
+            self.image_engine.warmup()
+    
+    @contextmanager
+    def _gpu_usage(self) -> Iterator[None]:
+        """Hold the GPU lock and charge the time to the current request's key"""
+        elapsed = 0.0
+        try:
+            with self.gpu_lock:
+                start = time.monotonic()
+                try:
+                    yield
+                finally:
+                    elapsed = time.monotonic() - start
+        finally:
+            # Charged after releasing the lock so the shared store write never blocks the GPU
+            api_key = CURRENT_API_KEY.get()
+            if api_key is not None and elapsed:
+                self.api_auth.record_gpu_seconds(api_key.key_id, elapsed)
+    
+    @contextmanager
+    def _capture_latents(self) -> Iterator[List[Any]]:
+        """Record the latents the music model decodes so later edits can reuse them"""
+        captured = []
+        decode = self.music_model.latents2audio
+        
+        def capturing_decode(latents, *args, **kwargs):
+            captured.append(latents.detach().cpu())
+            return decode(latents, *args, **kwargs)
+        
+        self.music_model.latents2audio = capturing_decode
+        try:
+            yield captured
+        finally:
+            self.music_model.latents2audio = decode
+    
+    @contextmanager
+    def _reuse_latents(self, latents: Any) -> Iterator[None]:
+        """Serve cached latents where the music model would re-encode the source audio"""
+        encode = self.music_model.infer_latents
+        self.music_model.infer_latents = lambda _path: latents.to(
+            self.music_model.device, self.music_model.dtype
         )
-        self.image_pipe.to("cuda")
+        try:
+            yield
+        finally:
+            self.music_model.infer_latents = encode
     
     def _query_llm(self, question: str) -> str:
-        """Query the language model with a question"""
+        """Query the language model, sharing the answer with identical concurrent queries"""
+        # Scoped to the key so GPU time is charged to every caller that asked
+        api_key = CURRENT_API_KEY.get()
+        key_id = api_key.key_id if api_key is not None else None
+        key = SingleFlight.make_key("llm", {"key_id": key_id, "question": question})
+        return self.single_flight.do(key, lambda: self._run_llm(question))
+    
+    def _run_llm(self, question: str) -> str:
+        """Run the language model on a question"""
         messages = [{"role": "user", "content": question}]
         
         text = self.tokenizer.apply_chat_template(
@@ -316,10 +1526,11 @@ class MusicGenServer:
         
         model_inputs = self.tokenizer([text], return_tensors="pt").to(self.llm_model.device)
         
-        generated_ids = self.llm_model.generate(
-            model_inputs.input_ids,
-            max_new_tokens=MODEL_CONFIG.llm_max_new_tokens
-        )
+        with self._gpu_usage():
+            generated_ids = self.llm_model.generate(
+                model_inputs.input_ids,
+                max_new_tokens=MODEL_CONFIG.llm_max_new_tokens
+            )
         
         generated_ids = [
             output_ids[len(input_ids):] 
@@ -357,25 +1568,28 @@ class MusicGenServer:
     
     def _generate_thumbnail(self, prompt: str) -> str:
         """Generate and upload thumbnail image to R2"""
-        thumbnail_prompt = f"{prompt}, album cover art"
+        return self._generate_thumbnails([prompt])[0]
+    
+    def _generate_thumbnails(self, prompts: List[str]) -> List[str]:
+        """Generate thumbnails for several songs in batches and upload them to R2"""
+        thumbnail_prompts = [f"{prompt}, album cover art" for prompt in prompts]
         
-        image = self.image_pipe(
-            prompt=thumbnail_prompt,
-            num_inference_steps=MODEL_CONFIG.image_inference_steps,
-            guidance_scale=MODEL_CONFIG.image_guidance_scale
-        ).images[0]
+        with self._gpu_usage():
+            images = self.image_engine.generate(thumbnail_prompts)
         
-        # Save image locally
-        image_path = self.file_manager.get_temp_path(f"{uuid.uuid4()}.png")
-        image.save(image_path)
+        image_r2_keys = []
+        for image in images:
+            # Save image locally
+            with self.file_manager.temp_file("png") as image_path:
+                image.save(image_path)
+                self.file_manager.track(image_path)
+                
+                # Upload to R2
+                image_r2_key = self.storage_manager.generate_unique_key("png")
+                self.storage_manager.upload_file(image_path, image_r2_key)
+                image_r2_keys.append(image_r2_key)
         
-        try:
-            # Upload to R2
-            image_r2_key = self.storage_manager.generate_unique_key("png")
-            self.storage_manager.upload_file(image_path, image_r2_key)
-            return image_r2_key
-        finally:
-            self.file_manager.cleanup_file(image_path)
+        return image_r2_keys
     
     def _generate_and_upload_music(
         self,
@@ -384,32 +1598,87 @@ class MusicGenServer:
         audio_duration: float,
         infer_step: int,
         guidance_scale: float,
-        seed: int
-    ) -> str:
-        """Generate music and upload to R2"""
+        seed: int,
+        src_latents: Any = None,
+        **task_kwargs: Any
+    ) -> GeneratedAudio:
+        """Generate music, analyze it and upload both to R2"""
         print(f"Generated lyrics: \n{lyrics}")
         print(f"Prompt: \n{prompt}")
         
         # Generate music locally
-        audio_path = self.file_manager.get_temp_path(f"{uuid.uuid4()}.wav")
+        source_file = self.file_manager.temp_file("wav") if src_latents is not None else nullcontext()
+        with self.file_manager.temp_file("wav") as audio_path, source_file as src_path:
+            if src_path is not None:
+                # ACE-Step checks the source file exists; its latents come from the cache
+                open(src_path, "wb").close()
+                task_kwargs["src_audio_path"] = src_path
+            
+            with self._gpu_usage(), self._capture_latents() as captured, \
+                    (self._reuse_latents(src_latents) if src_latents is not None else nullcontext()):
+                output = self.music_model(
+                    prompt=prompt,
+                    lyrics=lyrics,
+                    audio_duration=audio_duration,
+                    infer_step=infer_step,
+                    guidance_scale=guidance_scale,
+                    save_path=audio_path,
+                    manual_seeds=str(seed),
+                    **task_kwargs
+                )
+            self.file_manager.track(audio_path)
+            
+            # Analyze before upload so players can skip decoding the WAV; the
+            # sidecar is optional, so no analysis error may fail the song
+            try:
+                sidecar = self.audio_analyzer.encode_sidecar(
+                    self.audio_analyzer.analyze_file(audio_path)
+                )
+            except Exception as e:
+                print(f"Skipping audio analysis: {type(e).__name__}: {e}")
+                sidecar = None
+            
+            # Upload to R2
+            audio_r2_key = self.storage_manager.generate_unique_key("wav")
+            self.storage_manager.upload_file(audio_path, audio_r2_key)
         
-        self.music_model(
-            prompt=prompt,
-            lyrics=lyrics,
-            audio_duration=audio_duration,
-            infer_step=infer_step,
-            guidance_scale=guidance_scale,
-            save_path=audio_path,
-            manual_seeds=str(seed)
+        analysis_r2_key = None
+        if sidecar is not None:
+            try:
+                analysis_r2_key = self.storage_manager.sidecar_key(
+                    audio_r2_key, ANALYSIS_CONFIG.sidecar_extension
+                )
+                self.storage_manager.upload_bytes(sidecar, analysis_r2_key, "application/json")
+            except Exception as e:
+                print(f"Skipping analysis sidecar upload: {type(e).__name__}: {e}")
+                analysis_r2_key = None
+        
+        # The pipeline returns its input parameters last, including the seeds it drew
+        params = output[-1] if output and isinstance(output[-1], dict) else {}
+        
+        # ACE-Step draws a random length when audio_duration <= 0 and reports it here
+        return GeneratedAudio(
+            r2_key=audio_r2_key,
+            analysis_r2_key=analysis_r2_key,
+            seeds=params.get("actual_seeds") or [seed],
+            audio_duration=float(params.get("audio_duration", audio_duration)),
+            latents=captured[-1] if captured else None
         )
+    
+    def _cache_song(self, generated: GeneratedAudio, song: CachedSong) -> None:
+        """Keep a generated song's latents so it can be retaken, repainted or extended
         
+        The song is already uploaded, so a caching failure is logged, not raised.
+        """
+        if generated.latents is None:
+            return
+        
+        api_key = CURRENT_API_KEY.get()
+        song = replace(song, owner_key_id=api_key.key_id if api_key is not None else "")
         try:
-            # Upload to R2
-            audio_r2_key = self.storage_manager.generate_unique_key("wav")
-            self.storage_manager.upload_file(audio_path, audio_r2_key)
-            return audio_r2_key
-        finally:
-            self.file_manager.cleanup_file(audio_path)
+            self.latent_store.put(generated.r2_key, generated.latents, song)
+        except Exception as e:
+            print(f"Skipping latent cache for {generated.r2_key}: {type(e).__name__}: {e}")
     
     def _generate_complete_music(
         self,
@@ -427,8 +1696,8 @@ class MusicGenServer:
         # Prepare lyrics
         final_lyrics = "[instrumental]" if instrumental else lyrics
         
-        # Generate and upload audio
-        audio_r2_key = self._generate_and_upload_music(
+        # Generate, analyze and upload audio
+        generated = self._generate_and_upload_music(
             prompt, final_lyrics, audio_duration, infer_step, guidance_scale, seed
         )
         
@@ -438,10 +1707,85 @@ class MusicGenServer:
         # Generate categories
         categories = self.generate_categories(description_for_categorization)
         
-        return GenerateMusicResponseR2(
-            r2_key=audio_r2_key,
+        self._cache_song(generated, CachedSong(
+            prompt=prompt,
+            lyrics=final_lyrics,
+            audio_duration=generated.audio_duration,
+            infer_step=infer_step,
+            guidance_scale=guidance_scale,
+            seeds=generated.seeds,
             cover_image_r2_key=cover_image_r2_key,
             categories=categories
+        ))
+        
+        return GenerateMusicResponseR2(
+            r2_key=generated.r2_key,
+            cover_image_r2_key=cover_image_r2_key,
+            categories=categories,
+            analysis_r2_key=generated.analysis_r2_key
+        )
+    
+    def _load_cached_song(self, song_r2_key: str, api_key: APIKey) -> Tuple[Any, CachedSong]:
+        """Fetch a song the key owns from the latent cache or raise an HTTP error"""
+        try:
+            cached = self.latent_store.get(song_r2_key)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        
+        # Other keys' songs look the same as missing ones so keys cannot be probed
+        if cached is not None and not api_key.admin and cached[1].owner_key_id != api_key.key_id:
+            cached = None
+        
+        if cached is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Song is not in the latent cache; generate it again instead"
+            )
+        return cached
+    
+    def _edit_song(
+        self,
+        latents: Any,
+        song: CachedSong,
+        task: str,
+        seed: int,
+        audio_duration: Optional[float] = None,
+        prompt: Optional[str] = None,
+        lyrics: Optional[str] = None,
+        **task_kwargs: Any
+    ) -> GenerateMusicResponseR2:
+        """Run an ACE-Step edit task from a cached song and cache the result"""
+        prompt = prompt or song.prompt
+        lyrics = lyrics or song.lyrics
+        
+        # Retakes only need the original seeds; region edits start from the latents
+        generated = self._generate_and_upload_music(
+            prompt,
+            lyrics,
+            song.audio_duration,
+            song.infer_step,
+            song.guidance_scale,
+            song.seeds[0],
+            src_latents=None if task == "retake" else latents,
+            task=task,
+            retake_seeds=None if seed == -1 else str(seed),
+            **task_kwargs
+        )
+        
+        self._cache_song(generated, replace(
+            song,
+            prompt=prompt,
+            lyrics=lyrics,
+            audio_duration=audio_duration or generated.audio_duration,
+            seeds=generated.seeds,
+            last_used=time.time()
+        ))
+        
+        return GenerateMusicResponseR2(
+            r2_key=generated.r2_key,
+            cover_image_r2_key=song.cover_image_r2_key,
+            categories=song.categories,
+            analysis_r2_key=generated.analysis_r2_key
         )
     
     # ===========================
@@ -454,22 +1798,30 @@ class MusicGenServer:
         return {"status": "healthy", "service": "music-generator"}
     
     @modal.fastapi_endpoint(method="POST")
-    def auth_status(self, token: str = Depends(bearer_auth)) -> AuthStatusResponse:
+    def auth_status(self, api_key: APIKey = Depends(api_auth)) -> AuthStatusResponse:
         """Check authentication status"""
         return AuthStatusResponse(
             authenticated=True,
             message="Authentication successful"
         )
     
+    @modal.fastapi_endpoint(method="GET")
+    def metrics(self, api_key: APIKey = Depends(api_auth)) -> UsageMetricsResponse:
+        """Per-key usage counters; admin keys see every key"""
+        key_id = None if api_key.admin else api_key.key_id
+        return UsageMetricsResponse(keys=self.api_auth.metrics(key_id))
+    
     @modal.fastapi_endpoint(method="POST")
-    def generate(self, token: str = Depends(bearer_auth)) -> GenerateMusicResponse:
+    def generate(self, api_key: APIKey = Depends(api_auth)) -> GenerateMusicResponse:
         """Simple music generation endpoint for testing"""
-        audio_path = self.file_manager.get_temp_path(f"{uuid.uuid4()}.wav")
+        CURRENT_API_KEY.set(api_key)
         
-        # Hardcoded example for testing
-        self.music_model(
-            prompt="electronic rap",
-            lyrics="""[verse]
+        with self.file_manager.temp_file("wav") as audio_path:
+            # Hardcoded example for testing
+            with self._gpu_usage():
+                self.music_model(
+                    prompt="electronic rap",
+                    lyrics="""[verse]
 Waves on the bass, pulsing in the speakers,
 Turn the dial up, we chasing six-figure features,
 Grinding on the beats, codes in the creases,
@@ -480,72 +1832,331 @@ Electro vibes, hearts beat with the hum,
 Urban legends ride, we ain't ever numb,
 Circuits sparking live, tapping on the drum,
 Living on the edge, never succumb.""",
-            audio_duration=AUDIO_CONFIG.default_duration,
-            infer_step=AUDIO_CONFIG.default_infer_step,
-            guidance_scale=AUDIO_CONFIG.default_guidance_scale,
-            save_path=audio_path,
-        )
-        
-        try:
+                    audio_duration=AUDIO_CONFIG.default_duration,
+                    infer_step=AUDIO_CONFIG.default_infer_step,
+                    guidance_scale=AUDIO_CONFIG.default_guidance_scale,
+                    save_path=audio_path,
+                )
+            self.file_manager.track(audio_path)
+            
             with open(audio_path, "rb") as f:
                 audio_bytes = f.read()
             
             audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
             return GenerateMusicResponse(audio_data=audio_b64)
-        finally:
-            self.file_manager.cleanup_file(audio_path)
     
     @modal.fastapi_endpoint(method="POST")
     def generate_from_description(
         self, 
         request: GenerateFromDescriptionRequest,
-        token: str = Depends(bearer_auth)
+        api_key: APIKey = Depends(api_auth)
     ) -> GenerateMusicResponseR2:
         """Generate music from a full description"""
-        prompt = self.generate_prompt(request.full_described_song)
+        CURRENT_API_KEY.set(api_key)
         
-        lyrics = ""
-        if not request.instrumental:
-            lyrics = self.generate_lyrics(request.full_described_song)
+        def run() -> GenerateMusicResponseR2:
+            prompt = self.generate_prompt(request.full_described_song)
+            
+            lyrics = ""
+            if not request.instrumental:
+                lyrics = self.generate_lyrics(request.full_described_song)
+            
+            return self._generate_complete_music(
+                prompt=prompt,
+                lyrics=lyrics,
+                description_for_categorization=request.full_described_song,
+                **request.model_dump(exclude={"full_described_song"})
+            )
         
-        return self._generate_complete_music(
-            prompt=prompt,
-            lyrics=lyrics,
-            description_for_categorization=request.full_described_song,
-            **request.model_dump(exclude={"full_described_song"})
+        key = SingleFlight.make_key(
+            "generate_from_description", {"key_id": api_key.key_id, "request": request}
         )
+        return self.single_flight.do(key, run)
     
     @modal.fastapi_endpoint(method="POST")
     def generate_with_lyrics(
         self, 
         request: GenerateWithCustomLyricsRequest,
-        token: str = Depends(bearer_auth)
+        api_key: APIKey = Depends(api_auth)
     ) -> GenerateMusicResponseR2:
         """Generate music with custom lyrics"""
-        return self._generate_complete_music(
-            prompt=request.prompt,
-            lyrics=request.lyrics,
-            description_for_categorization=request.prompt,
-            **request.model_dump(exclude={"prompt", "lyrics"})
+        CURRENT_API_KEY.set(api_key)
+        
+        def run() -> GenerateMusicResponseR2:
+            return self._generate_complete_music(
+                prompt=request.prompt,
+                lyrics=request.lyrics,
+                description_for_categorization=request.prompt,
+                **request.model_dump(exclude={"prompt", "lyrics"})
+            )
+        
+        key = SingleFlight.make_key(
+            "generate_with_lyrics", {"key_id": api_key.key_id, "request": request}
         )
+        return self.single_flight.do(key, run)
     
     @modal.fastapi_endpoint(method="POST")
     def generate_with_described_lyrics(
         self, 
         request: GenerateWithDescribedLyricsRequest,
-        token: str = Depends(bearer_auth)
+        api_key: APIKey = Depends(api_auth)
     ) -> GenerateMusicResponseR2:
         """Generate music with lyrics from description"""
-        lyrics = ""
-        if not request.instrumental:
-            lyrics = self.generate_lyrics(request.described_lyrics)
+        CURRENT_API_KEY.set(api_key)
         
-        return self._generate_complete_music(
-            prompt=request.prompt,
-            lyrics=lyrics,
-            description_for_categorization=request.prompt,
-            **request.model_dump(exclude={"described_lyrics", "prompt"})
+        def run() -> GenerateMusicResponseR2:
+            lyrics = ""
+            if not request.instrumental:
+                lyrics = self.generate_lyrics(request.described_lyrics)
+            
+            return self._generate_complete_music(
+                prompt=request.prompt,
+                lyrics=lyrics,
+                description_for_categorization=request.prompt,
+                **request.model_dump(exclude={"described_lyrics", "prompt"})
+            )
+        
+        key = SingleFlight.make_key(
+            "generate_with_described_lyrics", {"key_id": api_key.key_id, "request": request}
         )
+        return self.single_flight.do(key, run)
+    
+    @modal.fastapi_endpoint(method="POST")
+    def retake_song(
+        self,
+        request: RetakeSongRequest,
+        api_key: APIKey = Depends(api_auth)
+    ) -> GenerateMusicResponseR2:
+        """Generate a variation of a cached song from its original seeds"""
+        CURRENT_API_KEY.set(api_key)
+        
+        if not 0.0 < request.variance <= 1.0:
+            raise HTTPException(status_code=422, detail="variance must be in (0, 1]")
+        
+        def run() -> GenerateMusicResponseR2:
+            latents, song = self._load_cached_song(request.song_r2_key, api_key)
+            return self._edit_song(
+                latents, song, "retake", request.seed,
+                retake_variance=request.variance
+            )
+        
+        key = SingleFlight.make_key(
+            "retake_song", {"key_id": api_key.key_id, "request": request}
+        )
+        return self.single_flight.do(key, run)
+    
+    @modal.fastapi_endpoint(method="POST")
+    def repaint_song(
+        self,
+        request: RepaintSongRequest,
+        api_key: APIKey = Depends(api_auth)
+    ) -> GenerateMusicResponseR2:
+        """Regenerate one region of a cached song, keeping the rest"""
+        CURRENT_API_KEY.set(api_key)
+        
+        if not 0.0 < request.variance <= 1.0:
+            raise HTTPException(status_code=422, detail="variance must be in (0, 1]")
+        
+        def run() -> GenerateMusicResponseR2:
+            latents, song = self._load_cached_song(request.song_r2_key, api_key)
+            if not 0.0 <= request.start < request.end <= song.audio_duration:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Repaint region must lie within 0-{song.audio_duration:g} seconds"
+                )
+            
+            return self._edit_song(
+                latents, song, "repaint", request.seed,
+                prompt=request.prompt,
+                lyrics=request.lyrics,
+                repaint_start=request.start,
+                repaint_end=request.end,
+                retake_variance=request.variance
+            )
+        
+        key = SingleFlight.make_key(
+            "repaint_song", {"key_id": api_key.key_id, "request": request}
+        )
+        return self.single_flight.do(key, run)
+    
+    @modal.fastapi_endpoint(method="POST")
+    def extend_song(
+        self,
+        request: ExtendSongRequest,
+        api_key: APIKey = Depends(api_auth)
+    ) -> GenerateMusicResponseR2:
+        """Add new material before and/or after a cached song"""
+        CURRENT_API_KEY.set(api_key)
+        
+        if request.left_seconds < 0 or request.right_seconds < 0 \
+                or request.left_seconds + request.right_seconds == 0:
+            raise HTTPException(status_code=422, detail="Extension lengths must be non-negative and not both zero")
+        
+        def run() -> GenerateMusicResponseR2:
+            latents, song = self._load_cached_song(request.song_r2_key, api_key)
+            extended_duration = song.audio_duration + request.left_seconds + request.right_seconds
+            if extended_duration > AUDIO_CONFIG.max_duration:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Extended song would exceed {AUDIO_CONFIG.max_duration:g} seconds"
+                )
+            
+            # ACE-Step expresses extension as a repaint region outside the song
+            return self._edit_song(
+                latents, song, "extend", request.seed,
+                audio_duration=extended_duration,
+                repaint_start=-request.left_seconds,
+                repaint_end=song.audio_duration + request.right_seconds,
+                retake_variance=1.0
+            )
+        
+        key = SingleFlight.make_key(
+            "extend_song", {"key_id": api_key.key_id, "request": request}
+        )
+        return self.single_flight.do(key, run)
+    
+    @modal.fastapi_endpoint(method="POST")
+    def generate_covers(
+        self,
+        request: GenerateCoversRequest,
+        api_key: APIKey = Depends(api_auth)
+    ) -> GenerateCoversResponse:
+        """Generate cover art for several songs in batched pipeline calls"""
+        CURRENT_API_KEY.set(api_key)
+        
+        if not 0 < len(request.prompts) <= MODEL_CONFIG.image_max_covers_per_request:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Between 1 and {MODEL_CONFIG.image_max_covers_per_request} prompts are required"
+            )
+        
+        return GenerateCoversResponse(
+            cover_image_r2_keys=self._generate_thumbnails(request.prompts)
+        )
+
+
+# ===========================
+# BENCHMARK SECTION
+# ===========================
+
+@app.function(
+    image=image,
+    gpu=INFRA_CONFIG.gpu_type,
+    volumes={
+        "/models": model_volume,
+        INFRA_CONFIG.hf_cache_dir: hf_volume,
+        INFRA_CONFIG.benchmark_dir: benchmark_volume
+    },
+    timeout=INFRA_CONFIG.benchmark_timeout
+)
+def benchmark_engine_profiles(
+    profiles: str = ",".join(ENGINE_PROFILES),
+    durations: str = "30,60,180",
+    infer_steps: str = "27,60",
+    repeats: int = 3
+) -> List[Dict[str, Any]]:
+    """Measure latency and peak VRAM of each engine profile over a duration/step grid
+    
+    Each duration is warmed up once per profile, then every grid cell runs
+    `repeats` times. Results are saved as JSON to the engine-benchmarks volume
+    after every cell, with "complete" set once the whole grid has run.
+    
+    Run with: modal run main.py::benchmark_engine_profiles --durations 30,60 --infer-steps 27 --repeats 5
+    """
+    import gc
+    import statistics
+    import torch
+    
+    gpu_name = torch.cuda.get_device_name(0)
+    gpu_memory_gb = detect_gpu_memory_gb()
+    print(f"GPU: {gpu_name} ({gpu_memory_gb:.1f} GiB), "
+          f"auto profile: {select_engine_profile('auto', gpu_memory_gb).name}")
+    
+    # Saved after every cell so a timeout keeps the runs that finished
+    results = []
+    gpu_slug = re.sub(r"[^a-z0-9]+", "-", gpu_name.lower()).strip("-")
+    report_path = os.path.join(
+        INFRA_CONFIG.benchmark_dir, f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{gpu_slug}.json"
+    )
+    
+    def save_report(complete: bool) -> None:
+        with open(report_path, "w") as f:
+            json.dump({
+                "gpu": gpu_name,
+                "gpu_memory_gb": round(gpu_memory_gb, 1),
+                "repeats": repeats,
+                "complete": complete,
+                "results": results,
+            }, f, indent=2)
+        benchmark_volume.commit()
+    
+    duration_grid = tuple(float(d) for d in durations.split(","))
+    step_grid = [int(step) for step in infer_steps.split(",")]
+    
+    file_manager = FileManager()
+    
+    for profile_name in profiles.split(","):
+        profile = select_engine_profile(profile_name, gpu_memory_gb)
+        
+        start = time.perf_counter()
+        music_model = build_music_pipeline(profile)
+        load_seconds = time.perf_counter() - start
+        
+        # First call per shape pays for compilation and lazy init; keep it out of the grid
+        warmup_seconds = warmup_music_pipeline(music_model, file_manager, durations=duration_grid, infer_step=1)
+        
+        for duration in duration_grid:
+            for infer_step in step_grid:
+                latencies = []
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+                
+                for _ in range(repeats):
+                    with file_manager.temp_file("wav") as audio_path:
+                        start = time.perf_counter()
+                        music_model(
+                            prompt="electronic rap",
+                            lyrics="[instrumental]",
+                            audio_duration=duration,
+                            infer_step=infer_step,
+                            guidance_scale=AUDIO_CONFIG.default_guidance_scale,
+                            save_path=audio_path,
+                            manual_seeds="42"
+                        )
+                        torch.cuda.synchronize()
+                        latencies.append(time.perf_counter() - start)
+                
+                result = {
+                    "profile": profile.name,
+                    "audio_duration": duration,
+                    "infer_step": infer_step,
+                    "repeats": repeats,
+                    "latency_mean_seconds": round(statistics.mean(latencies), 3),
+                    "latency_min_seconds": round(min(latencies), 3),
+                    "latency_max_seconds": round(max(latencies), 3),
+                    "peak_vram_gb": round(torch.cuda.max_memory_allocated() / 1024 ** 3, 3),
+                    "load_seconds": round(load_seconds, 3),
+                    "warmup_seconds": round(warmup_seconds[duration], 3),
+                }
+                print(json.dumps(result))
+                results.append(result)
+                save_report(complete=False)
+        
+        # Release the pipeline before loading the next profile
+        del music_model
+        gc.collect()
+        torch.cuda.empty_cache()
+    
+    print(f"{'profile':<16}{'duration':>10}{'steps':>7}{'mean s':>9}{'min s':>8}{'max s':>8}{'peak GiB':>10}")
+    for result in results:
+        print(f"{result['profile']:<16}{result['audio_duration']:>10.0f}{result['infer_step']:>7}"
+              f"{result['latency_mean_seconds']:>9.2f}{result['latency_min_seconds']:>8.2f}"
+              f"{result['latency_max_seconds']:>8.2f}{result['peak_vram_gb']:>10.2f}")
+    
+    save_report(complete=True)
+    print(f"Saved results to {INFRA_CONFIG.benchmark_volume_name}:{os.path.basename(report_path)}")
+    
+    return results
 
 
 # ===========================
@@ -0,0 +1,67 @@
+import base64
+import os
+import sys
+import tempfile
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_RATE = 48000
+DURATION = 30
+
+
+def write_click_track(path: str, bpm: float) -> None:
+    """Write a 16-bit stereo WAV of decaying noise bursts on every beat"""
+    rng = np.random.default_rng(0)
+    signal = np.zeros(SAMPLE_RATE * DURATION)
+    burst = rng.standard_normal(2000) * np.exp(-np.arange(2000) / 300)
+    for start in range(0, len(signal) - len(burst), int(SAMPLE_RATE * 60 / bpm)):
+        signal[start:start + len(burst)] += burst
+
+    stereo = np.stack([signal, signal * 0.9], axis=1) * 0.3
+    pcm = (np.clip(stereo, -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(pcm.tobytes())
+
+
+def audio_analysis():
+    from main import AudioAnalyzer
+
+    analyzer = AudioAnalyzer()
+
+    # A full-scale 1 kHz sine in one channel measures about -3 LUFS
+    t = np.arange(SAMPLE_RATE * 5) / SAMPLE_RATE
+    sine = np.sin(2 * np.pi * 1000 * t).astype(np.float32)[:, None]
+    loudness = analyzer.integrated_loudness(sine, SAMPLE_RATE)
+    assert abs(loudness + 3.01) < 0.1, f"unexpected sine loudness {loudness}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for bpm in (90, 128, 174):
+            path = os.path.join(tmp, f"{bpm}.wav")
+            write_click_track(path, bpm)
+            analysis = analyzer.analyze_file(path)
+
+            assert analysis["duration"] == DURATION, f"unexpected duration {analysis['duration']}"
+            assert abs(analysis["bpm"] - bpm) < 2, f"expected {bpm} BPM, got {analysis['bpm']}"
+
+            for level in analysis["peaks"]:
+                peaks = np.frombuffer(base64.b64decode(level["data"]), dtype=np.int8)
+                assert len(peaks) == 2 * level["length"], "peak pairs do not match length"
+                assert (peaks[0::2] <= peaks[1::2]).all(), "peak min above max"
+
+            size = len(analyzer.encode_sidecar(analysis))
+            print(f"🎚️ {bpm} BPM: estimated {analysis['bpm']}, "
+                  f"{analysis['integrated_loudness_lufs']} LUFS, sidecar {size} bytes")
+
+    print("✅ Audio analysis matches the synthetic tracks")
+
+# ===========================
+# MAIN ENTRYPOINT
+# ===========================
+if __name__ == "__main__":
+    audio_analysis()
@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+from dataclasses import replace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tiny SDXL weights so the engine runs on CPU in seconds
+TINY_MODEL_ID = "hf-internal-testing/tiny-stable-diffusion-xl-pipe"
+
+
+def image_engine():
+    from main import ImageEngine, MODEL_CONFIG
+
+    config = replace(
+        MODEL_CONFIG,
+        image_model_id=TINY_MODEL_ID,
+        image_width=64,
+        image_height=64,
+        image_batch_size=2,
+        image_torch_compile=False
+    )
+
+    engine = ImageEngine(config, device="cpu")
+    engine.load(cache_dir=None)
+
+    start = time.time()
+    engine.warmup()
+    print(f"🔥 Warmup took {time.time() - start:.2f}s")
+
+    prompts = ["synthwave sunset", "lo-fi rainy window", "heavy metal skull"]
+    start = time.time()
+    images = engine.generate(prompts)
+    print(f"🖼️ Generated {len(images)} covers in {time.time() - start:.2f}s")
+
+    assert len(images) == len(prompts), f"expected {len(prompts)} images, got {len(images)}"
+    for image in images:
+        assert image.size == (64, 64), f"unexpected cover size {image.size}"
+
+    print("✅ Image engine produced fixed-size covers for a partial batch")
+
+# ===========================
+# MAIN ENTRYPOINT
+# ===========================
+if __name__ == "__main__":
+    image_engine()
@@ -0,0 +1,98 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FlakyVolume:
+    """Stands in for modal.Volume with a reload that always fails"""
+
+    def __init__(self):
+        self.reloads = 0
+
+    def reload(self):
+        self.reloads += 1
+        raise RuntimeError("volume busy")
+
+    def commit(self):
+        pass
+
+
+def _song(owner_key_id: str = "frontend"):
+    from main import CachedSong
+
+    return CachedSong(
+        prompt="electronic rap",
+        lyrics="[instrumental]",
+        audio_duration=30.0,
+        infer_step=27,
+        guidance_scale=15.0,
+        seeds=[42],
+        owner_key_id=owner_key_id
+    )
+
+
+def latent_cache():
+    import torch
+    from fastapi import HTTPException
+    from main import APIKey, LatentStore, MusicGenServer
+
+    latents = torch.zeros(8, 1024)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LatentStore(base_dir=tmp)
+        store.put("song-a.wav", latents, _song())
+
+        # A queued song is served from memory before the worker writes it
+        assert store.get("song-a.wav") is not None, "pending song was not served"
+        store.close()
+        assert os.path.isfile(os.path.join(tmp, "song-a", "meta.json")), "song was not written"
+
+        # A new container indexes the volume without reading every meta.json
+        store = LatentStore(base_dir=tmp)
+        entry_size = store._index[os.path.join(tmp, "song-a")]
+        _, song = store.get("song-a.wav")
+        assert song.owner_key_id == "frontend", f"unexpected owner {song.owner_key_id}"
+        store.close()
+
+        # Room for two songs: the least recently used one is evicted
+        store = LatentStore(base_dir=tmp, max_bytes=2 * entry_size)
+        store.put("song-b.wav", latents, _song())
+        store.close()
+        store = LatentStore(base_dir=tmp, max_bytes=2 * entry_size)
+        store.get("song-a.wav")
+        store.put("song-c.wav", latents, _song())
+        store.close()
+        assert sorted(os.listdir(tmp)) == ["song-a", "song-c"], f"unexpected entries {os.listdir(tmp)}"
+
+        # Misses reload the volume at most once per interval, and a failed reload is a miss
+        volume = FlakyVolume()
+        store = LatentStore(base_dir=tmp, volume=volume, reload_seconds=60)
+        assert store.get("song-x.wav") is None, "failed reload was not a miss"
+        assert store.get("song-y.wav") is None, "unknown song was found"
+        assert volume.reloads == 1, f"expected 1 reload, got {volume.reloads}"
+        store.close()
+
+        # Only the owning key or an admin key may edit a cached song
+        get_user_cls = getattr(MusicGenServer, "_get_user_cls", None)
+        cls = get_user_cls() if get_user_cls else MusicGenServer
+        server = cls.__new__(cls)
+        server.latent_store = LatentStore(base_dir=tmp)
+
+        server._load_cached_song("song-a.wav", APIKey(key_id="frontend", token_hash=""))
+        server._load_cached_song("song-a.wav", APIKey(key_id="ops", token_hash="", admin=True))
+        try:
+            server._load_cached_song("song-a.wav", APIKey(key_id="mobile", token_hash=""))
+            raise AssertionError("another key could load the song")
+        except HTTPException as e:
+            assert e.status_code == 404, f"expected 404, got {e.status_code}"
+        server.latent_store.close()
+
+    print("✅ Latent cache writes in the background, evicts by LRU and checks ownership")
+
+# ===========================
+# MAIN ENTRYPOINT
+# ===========================
+if __name__ == "__main__":
+    latent_cache()
@@ -0,0 +1,33 @@
+import requests
+import os
+
+
+def metrics():
+    bearer_token = os.environ.get("API_BEARER_TOKEN")
+
+    if not bearer_token:
+        print("Error: API_BEARER_TOKEN environment variable not set")
+        return
+
+    headers = {
+        "Authorization": f"Bearer {bearer_token}",
+        "Content-Type": "application/json"
+    }
+
+    response = requests.get(
+        "https://edwardbudaza--music-generator-musicgenserver-metrics.modal.run",
+        headers=headers
+    )
+
+    if response.status_code == 200:
+        for key_id, usage in response.json()["keys"].items():
+            print(f"🔑 {key_id}: {usage['requests']} requests, "
+                  f"{usage['rejected']} rejected, {usage['gpu_seconds']}s GPU")
+    else:
+        print(f"❌ Error: {response.status_code} - {response.text}")
+
+# ===========================
+# MAIN ENTRYPOINT
+# ===========================
+if __name__ == "__main__":
+    metrics()
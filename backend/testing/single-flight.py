@@ -0,0 +1,230 @@
+import inspect
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubLatents:
+    def detach(self):
+        return self
+
+    def cpu(self):
+        return self
+
+
+class SlowStubMusicModel:
+    """Stands in for ACEStepPipeline: sleeps, counts runs and writes a short WAV"""
+
+    device = "cpu"
+    dtype = "float32"
+
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def latents2audio(self, latents, save_path=None):
+        with wave.open(save_path, "wb") as f:
+            f.setnchannels(2)
+            f.setsampwidth(2)
+            f.setframerate(48000)
+            f.writeframes(b"\0" * 48000 * 4)
+
+    def infer_latents(self, path):
+        raise AssertionError("source audio should not be re-encoded")
+
+    def __call__(self, save_path, audio_duration, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        self.latents2audio(StubLatents(), save_path=save_path)
+        return [save_path, {"actual_seeds": [42], "audio_duration": audio_duration}]
+
+
+class _Inputs:
+    def __init__(self, input_ids):
+        self.input_ids = input_ids
+
+    def to(self, device):
+        return self
+
+
+class StubTokenizer:
+    def apply_chat_template(self, messages, tokenize, add_generation_prompt):
+        return messages[0]["content"]
+
+    def __call__(self, texts, return_tensors):
+        return _Inputs([[len(text)] for text in texts])
+
+    def batch_decode(self, ids, skip_special_tokens):
+        return ["Pop, Electronic" for _ in ids]
+
+
+class SlowStubLLM:
+    """Stands in for the causal LM: sleeps and counts generate calls"""
+
+    device = "cpu"
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, input_ids, max_new_tokens):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return [ids + [0] for ids in input_ids]
+
+
+class StubImage:
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(b"png")
+
+
+class StubImageEngine:
+    def generate(self, prompts):
+        return [StubImage() for _ in prompts]
+
+
+class StubStorage:
+    def upload_file(self, local_path, r2_key):
+        return r2_key
+
+    def upload_bytes(self, data, r2_key, content_type):
+        return r2_key
+
+    def generate_unique_key(self, extension):
+        return f"{time.time_ns()}.{extension}"
+
+    def sidecar_key(self, r2_key, extension):
+        return f"{os.path.splitext(r2_key)[0]}.{extension}"
+
+
+class StubLatentStore:
+    def __init__(self):
+        self.songs = {}
+
+    def put(self, song_r2_key, latents, song):
+        self.songs[song_r2_key] = (latents, song)
+
+
+def _server_class():
+    """The plain Python class behind the Modal class"""
+    import main
+
+    get_user_cls = getattr(main.MusicGenServer, "_get_user_cls", None)
+    return get_user_cls() if get_user_cls else main.MusicGenServer
+
+
+def _endpoint(cls, name):
+    """Unwrap a Modal endpoint so it can be called in-process"""
+    method = inspect.getattr_static(cls, name)
+    get_raw_f = getattr(method, "_get_raw_f", None)
+    if get_raw_f is not None:
+        return get_raw_f()
+    # Older modal releases expose the wrapped function as raw_f
+    return getattr(method, "raw_f", method)
+
+
+def _build_server(tmp: str):
+    import main
+
+    cls = _server_class()
+    server = cls.__new__(cls)
+    server.music_model = SlowStubMusicModel()
+    server.tokenizer = StubTokenizer()
+    server.llm_model = SlowStubLLM()
+    server.image_engine = StubImageEngine()
+    server.storage_manager = StubStorage()
+    server.file_manager = main.FileManager(base_dir=tmp)
+    server.audio_analyzer = main.AudioAnalyzer()
+    server.latent_store = StubLatentStore()
+    server.gpu_lock = threading.Lock()
+    server.single_flight = main.SingleFlight()
+    server.api_auth = main.APIKeyAuth(usage_store={})
+    return cls, server
+
+
+def _run_concurrently(fn, count):
+    results = [None] * count
+    errors = []
+
+    def worker(index):
+        try:
+            results[index] = fn()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def single_flight():
+    from main import APIKey, GenerateWithCustomLyricsRequest
+
+    api_key = APIKey(key_id="frontend", token_hash="")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cls, server = _build_server(tmp)
+        generate_with_lyrics = _endpoint(cls, "generate_with_lyrics")
+
+        # Same request as the frontend retry would send, modulo whitespace
+        requests_to_send = [
+            GenerateWithCustomLyricsRequest(prompt="electronic rap", lyrics="[verse] hello"),
+            GenerateWithCustomLyricsRequest(prompt="electronic rap ", lyrics="[verse] hello"),
+            GenerateWithCustomLyricsRequest(prompt="electronic rap", lyrics="[verse] hello", audio_duration=180),
+        ] * 3
+        pending = list(requests_to_send)
+        lock = threading.Lock()
+
+        def call():
+            with lock:
+                request = pending.pop()
+            return generate_with_lyrics(server, request, api_key=api_key)
+
+        results = _run_concurrently(call, len(requests_to_send))
+
+        assert server.music_model.calls == 1, f"expected 1 music run, got {server.music_model.calls}"
+        assert server.llm_model.calls == 1, f"expected 1 LLM run, got {server.llm_model.calls}"
+        assert len({result.r2_key for result in results}) == 1, "waiters did not share the leader's result"
+        assert server.single_flight.in_flight() == 0, "finished keys were not released"
+
+        # Identical LLM queries from concurrent requests share one generate call
+        server.llm_model.calls = 0
+        lyrics = _run_concurrently(lambda: server.generate_lyrics("songs about rain"), 5)
+        assert server.llm_model.calls == 1, f"expected 1 LLM run, got {server.llm_model.calls}"
+        assert len(set(lyrics)) == 1, "LLM waiters did not share the result"
+
+        # A later identical request is not deduplicated against a finished one
+        generate_with_lyrics(server, requests_to_send[0], api_key=api_key)
+        assert server.music_model.calls == 2, f"expected 2 music runs, got {server.music_model.calls}"
+
+        # Identical requests from different keys run separately and each key pays for its run
+        other_key = APIKey(key_id="mobile", token_hash="")
+        keys = [api_key, other_key]
+        _run_concurrently(lambda: generate_with_lyrics(server, requests_to_send[0], api_key=keys.pop()), 2)
+        assert server.music_model.calls == 4, f"expected 4 music runs, got {server.music_model.calls}"
+        usage = server.api_auth.usage_store
+        charged = {key.split(":")[0] for key, record in usage.items() if record["gpu_seconds"] > 0}
+        assert charged == {"frontend", "mobile"}, f"GPU time charged to {charged}"
+
+    print(f"✅ {len(requests_to_send)} concurrent identical requests ran the music model and LLM once")
+
+# ===========================
+# MAIN ENTRYPOINT
+# ===========================
+if __name__ == "__main__":
+    single_flight()
@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _write(path: str, size: int) -> None:
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+
+
+def temp_storage():
+    from fastapi import HTTPException
+    from main import FileManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A RAM disk that cannot hold the quota falls back to local disk
+        fallback_dir = os.path.join(tmp, "fallback")
+        file_manager = FileManager(
+            max_bytes=2 ** 62,
+            ram_disk_dir=os.path.join(tmp, "shm", "outputs"),
+            fallback_dir=fallback_dir
+        )
+        assert file_manager.base_dir == fallback_dir, f"unexpected base dir {file_manager.base_dir}"
+
+        # Files and directories left by a crash are swept at startup
+        base_dir = os.path.join(tmp, "outputs")
+        os.makedirs(os.path.join(base_dir, "crashed-call"))
+        _write(os.path.join(base_dir, "orphan.wav"), 10)
+        file_manager = FileManager(base_dir=base_dir, max_bytes=1000, min_free_bytes=0, wait_seconds=0.5)
+        assert os.listdir(base_dir) == [], f"orphans left behind: {os.listdir(base_dir)}"
+
+        # Files written next to the yielded path are removed with it
+        with file_manager.temp_file("wav") as audio_path:
+            _write(audio_path, 100)
+            _write(audio_path.replace(".wav", "_input_params.json"), 10)
+            file_manager.track(audio_path)
+            assert file_manager.total_bytes == 110, f"unexpected size {file_manager.total_bytes}"
+        assert os.listdir(base_dir) == [], f"temp files leaked: {os.listdir(base_dir)}"
+
+        # Over quota, a new temp file is rejected once the wait runs out
+        with file_manager.temp_file("wav") as audio_path:
+            _write(audio_path, 1200)
+            file_manager.track(audio_path)
+            start = time.monotonic()
+            try:
+                with file_manager.temp_file("wav"):
+                    raise AssertionError("temp file created over quota")
+            except HTTPException as e:
+                assert e.status_code == 503, f"expected 503, got {e.status_code}"
+            assert time.monotonic() - start >= 0.5, "request was rejected without waiting"
+
+        # ... and proceeds as soon as a running request releases its file
+        file_manager.wait_seconds = 5
+        written = threading.Event()
+
+        def hold_file():
+            with file_manager.temp_file("wav") as audio_path:
+                _write(audio_path, 1200)
+                file_manager.track(audio_path)
+                written.set()
+                time.sleep(0.3)
+
+        holder = threading.Thread(target=hold_file)
+        holder.start()
+        written.wait()
+        start = time.monotonic()
+        with file_manager.temp_file("wav"):
+            waited = time.monotonic() - start
+        holder.join()
+        assert 0.1 < waited < 5, f"unexpected wait {waited:.2f}s"
+        assert file_manager.total_bytes == 0, "released files are still counted"
+
+    print(f"✅ Temp storage falls back, sweeps orphans, and waited {waited:.2f}s for quota before 503")
+
+# ===========================
+# MAIN ENTRYPOINT
+# ===========================
+if __name__ == "__main__":
+    temp_storage()